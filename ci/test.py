@@ -106,7 +106,7 @@ class WhiskTests(object):
         with self.conf_file.open("r") as f:
             data = yaml.load(f.read(), Loader=yaml.Loader)
             cache_file = pathlib.Path(
-                data.get("cache", self.project_root / ".config.yaml")
+                data.get("cache", self.project_root / ".config.json")
             )
 
         with cache_file.open("r") as f:
@@ -205,6 +205,19 @@ class WhiskConfParseTests(WhiskTests, unittest.TestCase):
             env=env,
         )
 
+        # A changed variable is expanded again
+        env["TEST_VAR"] = "BAZ"
+
+        self.assertShellCode(
+            """\
+            . init-build-env
+            """,
+            {
+                "MY_VAR": "BAZ",
+            },
+            env=env,
+        )
+
         # A missing variable causes a failure
         self.assertShellCode(
             """\
@@ -213,6 +226,48 @@ class WhiskConfParseTests(WhiskTests, unittest.TestCase):
             success=False,
         )
 
+    def test_conf_change(self):
+        self.append_conf(
+            """\
+            hooks:
+                pre_init: |
+                    MY_VAR=FOO
+            """
+        )
+
+        self.assertShellCode(
+            """\
+            . init-build-env
+            """,
+            {
+                "MY_VAR": "FOO",
+            },
+        )
+
+        with self.conf_file.open("r") as f:
+            conf = f.read()
+
+        self.write_conf(conf.replace("MY_VAR=FOO", "MY_VAR=BARBAZ"))
+
+        self.assertShellCode(
+            """\
+            . init-build-env
+            """,
+            {
+                "MY_VAR": "BARBAZ",
+            },
+        )
+
+    def test_parsed_conf_private(self):
+        self.assertShellCode(
+            """\
+            . init-build-env
+            """
+        )
+
+        parsed = self.project_root / ".whisk.yaml.parsed.json"
+        self.assertEqual(parsed.stat().st_mode & 0o777, 0o600)
+
 
 class WhiskFetchTests(WhiskTests, unittest.TestCase):
     def setUp(self):
@@ -708,6 +763,85 @@ class WhiskInitTests(WhiskTests, unittest.TestCase):
             success=False,
         )
 
+    def test_unknown_product(self):
+        self.assertShellCode(
+            """\
+            . init-build-env --products="test-dunfell missing" --site=siteA --mode=modeA
+            """,
+            success=False,
+        )
+
+    def test_list_multiline_description(self):
+        self.write_conf(
+            """\
+            version: 2
+            defaults:
+                products:
+                - test-dunfell
+                mode: modeA
+                site: siteA
+
+            versions:
+                dunfell:
+                    oeinit: {ROOT}/ci/dummy-init
+
+            products:
+                test-dunfell:
+                    default_version: dunfell
+                    description: |
+                        First line
+                        Second line
+                other:
+                    default_version: dunfell
+
+            modes:
+                modeA: {{}}
+
+            sites:
+                siteA: {{}}
+            """.format(
+                ROOT=ROOT
+            )
+        )
+
+        self.assertShellCode(
+            """\
+            . init-build-env
+            configure --list > list.txt
+            """
+        )
+
+        with (self.project_root / "list.txt").open("r") as f:
+            self.assertEqual(
+                f.read(),
+                textwrap.dedent(
+                    """\
+                    Possible products:
+                        other
+                     *  test-dunfell  First line
+                                      Second line
+                    Possible modes:
+                     *  modeA
+                    Possible sites:
+                     *  siteA
+                    Possible versions:
+                        dunfell
+                     *  default
+                    """
+                ),
+            )
+
+    def test_empty_product(self):
+        # An empty product list is an error, even if products were previously
+        # configured
+        self.assertShellCode(
+            """\
+            . init-build-env --product=test-dunfell --site=siteA --mode=modeA
+            configure --products=""
+            """,
+            success=False,
+        )
+
     def test_multiple_products_joined(self):
         self.assertShellCode(
             """\
@@ -774,6 +908,78 @@ class WhiskInitTests(WhiskTests, unittest.TestCase):
             },
         )
 
+    def test_unchanged_files_not_rewritten(self):
+        self.assertShellCode(
+            """\
+            . init-build-env --product=test-dunfell --mode=modeA --site=siteA
+            """
+        )
+
+        site_conf = self.project_root / "build" / "conf" / "site.conf"
+        mtime = site_conf.stat().st_mtime_ns
+
+        self.assertShellCode(
+            """\
+            . init-build-env
+            configure --write
+            """
+        )
+        self.assertEqual(site_conf.stat().st_mtime_ns, mtime)
+
+    def test_legacy_yaml_cache(self):
+        self.append_conf(
+            """\
+            defaults:
+                mode: modeA
+                site: siteA
+                products:
+                - test-dunfell
+            """
+        )
+
+        # A cache written as YAML to the old default location is still used
+        with (self.project_root / ".config.yaml").open("w") as f:
+            f.write(
+                textwrap.dedent(
+                    """\
+                    cache_version: 1
+                    mode: modeB
+                    products:
+                    - test-zeus
+                    site: siteB
+                    version: default
+                    """
+                )
+            )
+
+        self.assertShellCode(
+            """\
+            . init-build-env
+            """,
+            {
+                "WHISK_SITE": "siteB",
+                "WHISK_MODE": "modeB",
+                "WHISK_PRODUCTS": "test-zeus",
+            },
+        )
+        self.assertConfigVar("mode", "modeB")
+
+        # The legacy cache is removed once the new cache is written, so
+        # deleting the new cache restores the defaults
+        self.assertFalse((self.project_root / ".config.yaml").exists())
+        (self.project_root / ".config.json").unlink()
+
+        self.assertShellCode(
+            """\
+            . init-build-env
+            """,
+            {
+                "WHISK_SITE": "siteA",
+                "WHISK_MODE": "modeA",
+                "WHISK_PRODUCTS": "test-dunfell",
+            },
+        )
+
     def test_ignore_cache(self):
         self.append_conf(
             """\
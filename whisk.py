@@ -15,50 +15,209 @@
 # limitations under the License.
 
 import argparse
+import collections
+import functools
 import itertools
 import json
-import jsonschema
 import os
 import pathlib
 import string
 import subprocess
 import sys
-import tabulate
 import textwrap
-import tqdm
-import yaml
 
-tabulate.PRESERVE_WHITESPACE = True
-
-THIS_DIR = pathlib.Path(__file__).parent.absolute()
+THIS_FILE = pathlib.Path(__file__).absolute()
+THIS_DIR = THIS_FILE.parent
 SCHEMA_FILE = THIS_DIR / "whisk.schema.json"
 
 CACHE_VERSION = 1
+PARSED_CONF_VERSION = 1
+
+ENV_TEMPLATE = textwrap.dedent(
+    """\
+    export WHISK_PRODUCTS="{products}"
+    export WHISK_MODE="{mode}"
+    export WHISK_SITE="{site}"
+    export WHISK_VERSION="{version}"
+    export WHISK_ACTUAL_VERSION="{actual_version}"
+
+    export WHISK_BUILD_DIR={build_dir}
+    export WHISK_INIT={init}
+    """
+)
+
+ENV_INIT_TEMPLATE = textwrap.dedent(
+    """\
+    export WHISK_PROJECT_ROOT="{root}"
+    export BB_ENV_EXTRAWHITE="${{BB_ENV_EXTRAWHITE}} WHISK_PROJECT_ROOT WHISK_PRODUCTS WHISK_MODE WHISK_SITE WHISK_ACTUAL_VERSION"
+    PATH="{this_dir}/bin:$PATH"
+    """
+)
+
+ENV_PYREX_TEMPLATE = textwrap.dedent(
+    """\
+    PYREX_CONFIG_BIND="{root}"
+    PYREX_ROOT="{version[pyrex][root]}"
+    PYREX_OEINIT="{version[oeinit]}"
+    PYREXCONFFILE="{version[pyrex][conf]}"
+
+    . {version[pyrex][root]}/pyrex-init-build-env $WHISK_BUILD_DIR
+    """
+)
+
+SITE_DEPLOY_V1 = textwrap.dedent(
+    """\
+    DEPLOY_DIR_BASE ?= "${TOPDIR}/deploy/${WHISK_MODE}/${WHISK_ACTUAL_VERSION}"
+    WHISK_DEPLOY_DIR_BASE ?= "${DEPLOY_DIR_BASE}"
+
+    WHISK_DEPLOY_DIR_core = "${WHISK_DEPLOY_DIR_BASE}/core"
+    DEPLOY_DIR_core = "${WHISK_DEPLOY_DIR_core}"
+    """
+)
+
+SITE_DEPLOY_V2 = textwrap.dedent(
+    """\
+    WHISK_DEPLOY_DIR_BASE ?= "${TOPDIR}/deploy/${WHISK_MODE}/${WHISK_ACTUAL_VERSION}"
+
+    WHISK_DEPLOY_DIR_core = "${WHISK_DEPLOY_DIR_BASE}/core"
+    """
+)
+
+SITE_TEMPLATE = textwrap.dedent(
+    """\
+    BBPATH .= ":${TOPDIR}/whisk"
+
+    WHISK_PRODUCT ?= "core"
+
+    # Set TMPDIR to a version specific location
+    TMPDIR_BASE ?= "${TOPDIR}/tmp/${WHISK_MODE}/${WHISK_ACTUAL_VERSION}"
+
+    TMPDIR = "${TMPDIR_BASE}/${WHISK_PRODUCT}"
+
+    # Set the deploy directory to output to a well-known location
+    DEPLOY_DIR = "${WHISK_DEPLOY_DIR_${WHISK_PRODUCT}}"
+    DEPLOY_DIR_IMAGE = "${DEPLOY_DIR}/images"
+    """
+)
+
+SITE_PRODUCT_TEMPLATE = textwrap.dedent(
+    """\
+    WHISK_DEPLOY_DIR_{p} = "${{WHISK_DEPLOY_DIR_BASE}}/{p}"
+    WHISK_TARGETS_{p} = "{targets}"
+    """
+)
+
+SITE_MULTICONFIG_TEMPLATE = textwrap.dedent(
+    """\
+    BBMULTICONFIG = "{multiconfigs}"
+    BBMASK += "${{BBMASK_${{WHISK_PRODUCT}}}}"
+
+    BB_HASHBASE_WHITELIST_append = " WHISK_PROJECT_ROOT"
+    """
+)
+
+PRODUCT_CONF_TEMPLATE = textwrap.dedent(
+    """\
+    # This file was dynamically generated by whisk
+    WHISK_PRODUCT = "{product}"
+    WHISK_PRODUCT_DESCRIPTION = "{description}"
+
+    """
+)
+
+BBLAYERS_HEADER = textwrap.dedent(
+    """\
+    # This file was dynamically generated by whisk
+    BBPATH = "${TOPDIR}"
+    BBFILES ?= ""
+
+    """
+)
+
+BBLAYERS_FOOTER = textwrap.dedent(
+    """\
+    # This line gives devtool a place to add its layers
+    BBLAYERS += ""
+    """
+)
 
 
 class ConfTemplate(string.Template):
     delimiter = r"%"
 
 
+# Splits each occurrence of an argument on whitespace and accumulates the words
+# into a set. The set is empty (but not None) if the argument was only given
+# empty values
+class SplitSetAction(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        setattr(
+            namespace,
+            self.dest,
+            (getattr(namespace, self.dest) or set()) | set(values.split()),
+        )
+
+
+def write_file(path, parts, exists=True):
+    # Output is encoded once and written in binary mode with a single call
+    data = "".join(parts).encode("utf-8")
+
+    # Files whose contents haven't changed are left alone so that their
+    # modification time doesn't change
+    if exists:
+        try:
+            if path.stat().st_size == len(data) and path.read_bytes() == data:
+                return
+        except OSError:
+            pass
+
+    path.write_bytes(data)
+
+
+def yaml_load(stream):
+    import yaml
+
+    return yaml.load(stream, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
+
+@functools.lru_cache(maxsize=None)
+def get_schema_validator():
+    import fastjsonschema
+
+    with SCHEMA_FILE.open("r") as f:
+        return fastjsonschema.compile(json.load(f))
+
+
+def validate_conf(conf):
+    get_schema_validator()(conf)
+
+
+def print_table(rows):
+    # Cells may span multiple lines. Continuation lines are padded so they
+    # stay aligned under their column
+    rows = [[c.splitlines() or [""] for c in r] for r in rows]
+    widths = [max(len(l) for c in col for l in c) for col in zip(*rows)]
+    for r in rows:
+        for line in itertools.zip_longest(*r, fillvalue=""):
+            print("  ".join(c.ljust(w) for c, w in zip(line, widths)).rstrip())
+
+
 def print_items(items, is_current, extra=[]):
     def get_current(i):
         if is_current(i):
             return " *"
         return "  "
 
-    print(
-        tabulate.tabulate(
-            [
-                (
-                    get_current(i),
-                    i,
-                    items[i].get("description", ""),
-                )
-                for i in sorted(items)
-            ]
-            + [(get_current(e), e, "") for e in extra],
-            tablefmt="plain",
-        )
+    print_table(
+        [
+            (
+                get_current(i),
+                i,
+                str(items[i].get("description", "")),
+            )
+            for i in sorted(items)
+        ]
+        + [(get_current(e), e, "") for e in extra]
     )
 
 
@@ -78,16 +237,136 @@ def print_versions(conf, cur_version):
     print_items(conf["versions"], lambda v: v == cur_version, extra=["default"])
 
 
-def write_hook(f, conf, hook):
-    f.write(conf.get("hooks", {}).get(hook, ""))
-    f.write("\n")
+def get_hook(conf, hook):
+    return conf.get("hooks", {}).get(hook, "") + "\n"
 
 
-def parse_conf_file(path):
+@functools.lru_cache(maxsize=None)
+def get_product_conf(name, description, conf):
+    return "".join(
+        [
+            PRODUCT_CONF_TEMPLATE.format(product=name, description=description),
+            conf,
+            "\n",
+        ]
+    )
+
+
+def get_template_env(project_root):
+    return collections.ChainMap(
+        {"WHISK_PROJECT_ROOT": str(project_root.absolute())}, os.environ
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def read_conf_template(path, mtime_ns):
     with path.open("r") as f:
-        conf_str = f.read()
+        return f.read()
+
+
+@functools.lru_cache(maxsize=None)
+def get_template_vars(conf_str):
+    names = set()
+    for m in ConfTemplate.pattern.finditer(conf_str):
+        name = m.group("named") or m.group("braced")
+        if name:
+            names.add(name)
+    return frozenset(names)
+
 
-    conf = yaml.load(conf_str, Loader=yaml.Loader)
+def get_parsed_conf_path(path):
+    return path.with_name(".%s.parsed.json" % path.name)
+
+
+def stat_conf_inputs(path):
+    # The parsed configuration depends on the config file, the schema and whisk
+    # itself
+    return (path.stat(), SCHEMA_FILE.stat(), THIS_FILE.stat())
+
+
+def read_parsed_conf(path, stats):
+    (conf_stat, schema_stat, whisk_stat) = stats
+    try:
+        with get_parsed_conf_path(path).open("r") as f:
+            parsed = json.load(f)
+    except (OSError, ValueError):
+        return (None, None)
+
+    try:
+        if (
+            parsed["cache_version"] != PARSED_CONF_VERSION
+            or parsed["conf_mtime"] != conf_stat.st_mtime_ns
+            or parsed["conf_size"] != conf_stat.st_size
+            or parsed["schema_mtime"] != schema_stat.st_mtime_ns
+            or parsed["whisk_mtime"] != whisk_stat.st_mtime_ns
+        ):
+            return (None, None)
+
+        project_root = path.parent / parsed["project_root"]
+
+        env = get_template_env(project_root)
+        for name, value in parsed["variables"].items():
+            if env.get(name) != value:
+                return (None, None)
+
+        return (parsed["conf"], project_root)
+    except (KeyError, TypeError, AttributeError):
+        return (None, None)
+
+
+def read_user_cache(path):
+    with path.open("r") as f:
+        data = f.read()
+
+    # The cache is written as JSON, but may have been written as YAML by an
+    # older version of whisk
+    try:
+        return json.loads(data)
+    except ValueError:
+        return yaml_load(data)
+
+
+def write_parsed_conf(path, stats, conf, project_root_str, variables):
+    (conf_stat, schema_stat, whisk_stat) = stats
+    try:
+        data = json.dumps(
+            {
+                "cache_version": PARSED_CONF_VERSION,
+                "conf_mtime": conf_stat.st_mtime_ns,
+                "conf_size": conf_stat.st_size,
+                "schema_mtime": schema_stat.st_mtime_ns,
+                "whisk_mtime": whisk_stat.st_mtime_ns,
+                "project_root": project_root_str,
+                "variables": variables,
+                "conf": conf,
+            }
+        ).encode("utf-8")
+
+        # The parsed configuration contains the values of expanded environment
+        # variables, so only the owner may read it
+        fd = os.open(
+            get_parsed_conf_path(path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+        )
+        with os.fdopen(fd, "wb") as f:
+            os.fchmod(f.fileno(), 0o600)
+            f.write(data)
+    except OSError:
+        pass
+
+
+def parse_conf_file(path):
+    # Stat the inputs once, before they are read, so that the parsed
+    # configuration is never recorded as matching a newer file than the one
+    # that was actually parsed
+    stats = stat_conf_inputs(path)
+
+    (conf, project_root) = read_parsed_conf(path, stats)
+    if conf is not None:
+        return (conf, project_root)
+
+    conf_str = read_conf_template(path, stats[0].st_mtime_ns)
+
+    conf = yaml_load(conf_str)
 
     if not "version" in conf:
         print("Config file '%s' missing version" % sys_args.conf)
@@ -97,27 +376,40 @@ def parse_conf_file(path):
         print("Bad version %r in config file '%s'" % (conf["version"], path))
         return (None, None)
 
-    project_root = path.parent / conf.get("project_root", ".")
+    project_root_str = conf.get("project_root", ".")
+    project_root = path.parent / project_root_str
 
     # Re-parse, expanding variables
-    env = os.environ.copy()
-    env["WHISK_PROJECT_ROOT"] = project_root.absolute()
-    conf = yaml.load(ConfTemplate(conf_str).substitute(**env), Loader=yaml.Loader)
+    env = get_template_env(project_root)
+    conf = yaml_load(ConfTemplate(conf_str).substitute(env))
+
+    import fastjsonschema
 
     try:
-        with SCHEMA_FILE.open("r") as f:
-            jsonschema.validate(conf, json.load(f))
-    except jsonschema.ValidationError as e:
+        validate_conf(conf)
+    except fastjsonschema.JsonSchemaException as e:
         print("Error validating %s: %s" % (path, e.message))
         return (None, None)
 
+    # Record the values of all variables that were expanded so that the parsed
+    # configuration is discarded if any of them change
+    write_parsed_conf(
+        path,
+        stats,
+        conf,
+        project_root_str,
+        {name: env.get(name) for name in get_template_vars(conf_str)},
+    )
+
     return (conf, project_root)
 
 
 def configure(sys_args):
     parser = argparse.ArgumentParser(description="Configure build")
     parser.add_argument(
-        "--products", action="append", default=[], help="Change build product(s)"
+        "--products",
+        action=SplitSetAction,
+        help="Change build product(s)",
     )
     parser.add_argument("--mode", help="Change build mode")
     parser.add_argument("--site", help="Change build site")
@@ -146,20 +438,31 @@ def configure(sys_args):
     if not conf:
         return 1
 
+    products = conf.get("products", {})
+    modes = conf.get("modes", {})
+    sites = conf.get("sites", {})
+    versions = conf["versions"]
+
     def get_product(name):
         nonlocal conf
         if name == "core":
             return conf.get("core", {})
-        return conf["products"][name]
+        return products[name]
+
+    cache_path = pathlib.Path(conf.get("cache", project_root / ".config.json"))
+    cache_paths = [cache_path]
+    if "cache" not in conf:
+        # Older versions of whisk wrote the cache to .config.yaml by default
+        cache_paths.append(project_root / ".config.yaml")
 
-    cache_path = pathlib.Path(conf.get("cache", project_root / ".config.yaml"))
     cache = {}
     if not user_args.no_config:
-        try:
-            with cache_path.open("r") as f:
-                cache = yaml.load(f, Loader=yaml.Loader)
-        except OSError:
-            pass
+        for p in cache_paths:
+            try:
+                cache = read_user_cache(p)
+                break
+            except OSError:
+                pass
 
         try:
             if cache.get("cache_version") != CACHE_VERSION:
@@ -189,21 +492,22 @@ def configure(sys_args):
         print_versions(conf, cur_version)
         return 0
 
-    if user_args.products:
+    if user_args.products is not None:
         write = True
-        user_products = sorted(
-            set(itertools.chain(*(a.split() for a in user_args.products)))
-        )
-        for p in user_products:
-            if not p in conf.get("products", {}):
-                print("Unknown product '%s'. Please choose from:" % p)
-                print_products(conf, cur_products)
-                return 1
+        user_products = sorted(user_args.products)
+        missing = [p for p in user_products if p not in products]
+        if missing:
+            print(
+                "Unknown product%s '%s'. Please choose from:"
+                % ("s" if len(missing) > 1 else "", " ".join(missing))
+            )
+            print_products(conf, cur_products)
+            return 1
         cur_products = user_products
 
     if user_args.mode:
         write = True
-        if user_args.mode not in conf["modes"]:
+        if user_args.mode not in modes:
             print("Unknown mode '%s'. Please choose from:" % user_args.mode)
             print_modes(conf, cur_mode)
             return 1
@@ -211,7 +515,7 @@ def configure(sys_args):
 
     if user_args.site:
         write = True
-        if user_args.site not in conf["sites"]:
+        if user_args.site not in sites:
             print("Unknown site '%s'. Please choose from:" % user_args.site)
             print_sites(conf, cur_site)
             return 1
@@ -220,10 +524,7 @@ def configure(sys_args):
     if user_args.version:
         write = True
         if sys_args.init:
-            if (
-                user_args.version != "default"
-                and user_args.version not in conf["versions"]
-            ):
+            if user_args.version != "default" and user_args.version not in versions:
                 print("Unknown version '%s'. Please choose from:" % user_args.version)
                 print_versions(conf, cur_version)
                 return 1
@@ -245,6 +546,9 @@ def configure(sys_args):
             return 1
         build_dir = pathlib.Path(user_args.build_dir)
 
+    root_abs = str(project_root.absolute())
+    build_abs = str(build_dir.absolute())
+
     if not cur_products:
         print("One or more products must be specified with --product")
         return 1
@@ -262,7 +566,7 @@ def configure(sys_args):
         product_versions = {}
 
         for p in cur_products:
-            v = conf["products"][p]["default_version"]
+            v = products[p]["default_version"]
             product_versions.setdefault(v, []).append(p)
 
         keys = list(product_versions)
@@ -284,39 +588,37 @@ def configure(sys_args):
             print(
                 "Multiple products with different default versions were chosen. They are:"
             )
-            print(
-                tabulate.tabulate(
-                    [(k, " ".join(v)) for k, v in product_versions.items()],
-                    tablefmt="plain",
-                )
-            )
+            print_table([(k, " ".join(v)) for k, v in product_versions.items()])
             return 1
 
     else:
         cur_actual_version = cur_version
 
-    version = conf["versions"][cur_actual_version]
+    # Layer information is only needed when fetching or writing out the
+    # build configuration
+    if write or user_args.fetch:
+        version = versions[cur_actual_version]
 
-    cur_layers = {l["name"]: l.get("paths", []) for l in version.get("layers", [])}
+        cur_layer_names = frozenset(l["name"] for l in version.get("layers", []))
 
-    # Sanity check that all configured products have layers
-    for p in ["core"] + cur_products:
-        missing = set(
-            l for l in get_product(p).get("layers", []) if not l in cur_layers
-        )
-        if missing:
-            print(
-                "Product '{product}' requires layer collection(s) '{layers}' which is not present in version '{version}'".format(
-                    product=p, layers=" ".join(missing), version=cur_actual_version
+        # Sanity check that all configured products have layers
+        for p in ["core"] + cur_products:
+            missing = set(get_product(p).get("layers", [])) - cur_layer_names
+            if missing:
+                print(
+                    "Product '{product}' requires layer collection(s) '{layers}' which is not present in version '{version}'".format(
+                        product=p, layers=" ".join(missing), version=cur_actual_version
+                    )
                 )
-            )
-            return 1
+                return 1
 
-    requested_layers = set()
-    for name in ["core"] + cur_products:
-        requested_layers.update(get_product(name).get("layers", []))
+        requested_layers = set()
+        for name in ["core"] + cur_products:
+            requested_layers.update(get_product(name).get("layers", []))
 
     if user_args.fetch:
+        import tqdm
+
         fetch_commands = []
         for o in [conf, version] + [
             l for l in version.get("layers", []) if l["name"] in requested_layers
@@ -324,7 +626,7 @@ def configure(sys_args):
             fetch_commands.extend(o.get("fetch", {}).get("commands", []))
 
         env = os.environ.copy()
-        env["WHISK_PROJECT_ROOT"] = project_root.absolute()
+        env["WHISK_PROJECT_ROOT"] = root_abs
 
         for c in tqdm.tqdm(
             fetch_commands,
@@ -344,79 +646,43 @@ def configure(sys_args):
                 print("Fetch command '%s' failed:\n%s" % (c, r.stdout))
                 return 1
 
-    with sys_args.env.open("w") as f:
-        f.write(
-            textwrap.dedent(
-                """\
-                export WHISK_PRODUCTS="{products}"
-                export WHISK_MODE="{mode}"
-                export WHISK_SITE="{site}"
-                export WHISK_VERSION="{version}"
-                export WHISK_ACTUAL_VERSION="{actual_version}"
-
-                export WHISK_BUILD_DIR={build_dir}
-                export WHISK_INIT={init}
-                """
-            ).format(
-                products=" ".join(cur_products),
-                mode=cur_mode,
-                site=cur_site,
-                version=cur_version,
-                actual_version=cur_actual_version,
-                build_dir=str(build_dir.absolute()),
-                init="true" if sys_args.init else "false",
-            )
-        )
-
-        write_hook(f, conf, "pre_init")
-        if sys_args.init:
-            bitbake_dir = version.get("bitbakedir")
-            if bitbake_dir:
-                f.write('export BITBAKEDIR="%s"\n' % bitbake_dir)
-
-            f.write(
-                textwrap.dedent(
-                    """\
-                    export WHISK_PROJECT_ROOT="{root}"
-                    export BB_ENV_EXTRAWHITE="${{BB_ENV_EXTRAWHITE}} WHISK_PROJECT_ROOT WHISK_PRODUCTS WHISK_MODE WHISK_SITE WHISK_ACTUAL_VERSION"
-                    PATH="{this_dir}/bin:$PATH"
-                    """
-                ).format(
-                    root=project_root.absolute(),
-                    this_dir=THIS_DIR,
-                )
+    parts = [
+        ENV_TEMPLATE.format(
+            products=" ".join(cur_products),
+            mode=cur_mode,
+            site=cur_site,
+            version=cur_version,
+            actual_version=cur_actual_version,
+            build_dir=build_abs,
+            init="true" if sys_args.init else "false",
+        ),
+        get_hook(conf, "pre_init"),
+    ]
+
+    if sys_args.init:
+        bitbake_dir = version.get("bitbakedir")
+        if bitbake_dir:
+            parts.append('export BITBAKEDIR="%s"\n' % bitbake_dir)
+
+        parts.append(ENV_INIT_TEMPLATE.format(root=root_abs, this_dir=THIS_DIR))
+
+        if version.get("pyrex"):
+            parts.append(ENV_PYREX_TEMPLATE.format(root=root_abs, version=version))
+        else:
+            parts.append(
+                ". {version[oeinit]} $WHISK_BUILD_DIR\n".format(version=version)
             )
 
-            if version.get("pyrex"):
-                f.write(
-                    textwrap.dedent(
-                        """\
-                        PYREX_CONFIG_BIND="{root}"
-                        PYREX_ROOT="{version[pyrex][root]}"
-                        PYREX_OEINIT="{version[oeinit]}"
-                        PYREXCONFFILE="{version[pyrex][conf]}"
-
-                        . {version[pyrex][root]}/pyrex-init-build-env $WHISK_BUILD_DIR
-                        """
-                    ).format(
-                        root=project_root.absolute(),
-                        version=version,
-                    )
-                )
-
-            else:
-                f.write(
-                    ". {version[oeinit]} $WHISK_BUILD_DIR\n".format(version=version)
-                )
-
-        write_hook(f, conf, "post_init")
+    parts.append(get_hook(conf, "post_init"))
+    parts.append("unset WHISK_BUILD_DIR WHISK_INIT\n")
 
-        f.write("unset WHISK_BUILD_DIR WHISK_INIT\n")
+    write_file(sys_args.env, parts)
 
     if not user_args.no_config:
-        with cache_path.open("w") as f:
-            f.write(
-                yaml.dump(
+        write_file(
+            cache_path,
+            [
+                json.dumps(
                     {
                         "cache_version": CACHE_VERSION,
                         "mode": cur_mode,
@@ -424,166 +690,127 @@ def configure(sys_args):
                         "site": cur_site,
                         "version": cur_version,
                         "actual_version": cur_actual_version,
-                        "build_dir": str(build_dir.absolute()),
+                        "build_dir": build_abs,
                     },
-                    Dumper=yaml.Dumper,
+                    sort_keys=True,
                 )
-            )
+            ],
+        )
 
-    if write:
-        (build_dir / "conf").mkdir(parents=True, exist_ok=True)
+        # Remove the legacy cache now that it has been replaced, so that it
+        # doesn't come back if the new cache is deleted
+        for p in cache_paths[1:]:
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
 
-        with (build_dir / "conf" / "site.conf").open("w") as f:
-            f.write("# This file was dynamically generated by whisk\n")
+    if write:
+        import concurrent.futures
 
-            f.write(conf["sites"][cur_site].get("conf", ""))
-            f.write("\n")
-            f.write(conf["modes"][cur_mode].get("conf", ""))
-            f.write("\n")
+        conf_dir = build_dir / "conf"
+        mc_dir = build_dir / "whisk" / "conf" / "multiconfig"
+        conf_dir.mkdir(parents=True, exist_ok=True)
+        mc_dir.mkdir(parents=True, exist_ok=True)
 
+        # Note which output files already exist so that only those need to be
+        # compared against their new contents
+        existing = set()
+        for d in (conf_dir, mc_dir):
+            with os.scandir(d) as it:
+                existing.update(pathlib.Path(e.path) for e in it)
+
+        outputs = {}
+
+        # Gather everything needed from each product in a single pass
+        product_records = [
+            (
+                name,
+                sorted(p.get("targets", [])),
+                p.get("description", ""),
+                p.get("conf", ""),
+            )
+            for name, p in sorted(products.items())
+        ]
+
+        parts = [
+            "# This file was dynamically generated by whisk\n",
+            sites[cur_site].get("conf", ""),
+            "\n",
+            modes[cur_mode].get("conf", ""),
+            "\n",
+            SITE_DEPLOY_V1 if conf["version"] < 2 else SITE_DEPLOY_V2,
+            SITE_TEMPLATE,
+            'WHISK_TARGETS_core = "%s"\n'
+            % (" ".join("${WHISK_TARGETS_%s}" % p for p in cur_products)),
+        ]
+
+        for name, targets, _, _ in product_records:
             if conf["version"] < 2:
-                f.write(
-                    textwrap.dedent(
-                        """\
-                        DEPLOY_DIR_BASE ?= "${TOPDIR}/deploy/${WHISK_MODE}/${WHISK_ACTUAL_VERSION}"
-                        WHISK_DEPLOY_DIR_BASE ?= "${DEPLOY_DIR_BASE}"
-
-                        WHISK_DEPLOY_DIR_core = "${WHISK_DEPLOY_DIR_BASE}/core"
-                        DEPLOY_DIR_core = "${WHISK_DEPLOY_DIR_core}"
-                        """
-                    )
-                )
-            else:
-                f.write(
-                    textwrap.dedent(
-                        """\
-                        WHISK_DEPLOY_DIR_BASE ?= "${TOPDIR}/deploy/${WHISK_MODE}/${WHISK_ACTUAL_VERSION}"
-
-                        WHISK_DEPLOY_DIR_core = "${WHISK_DEPLOY_DIR_BASE}/core"
-                        """
-                    )
+                parts.append(
+                    'DEPLOY_DIR_{p} = "${{WHISK_DEPLOY_DIR_{p}}}"\n'.format(p=name)
                 )
 
-            f.write(
-                textwrap.dedent(
-                    """\
-                    BBPATH .= ":${TOPDIR}/whisk"
-
-                    WHISK_PRODUCT ?= "core"
-
-                    # Set TMPDIR to a version specific location
-                    TMPDIR_BASE ?= "${TOPDIR}/tmp/${WHISK_MODE}/${WHISK_ACTUAL_VERSION}"
-
-                    TMPDIR = "${TMPDIR_BASE}/${WHISK_PRODUCT}"
-
-                    # Set the deploy directory to output to a well-known location
-                    DEPLOY_DIR = "${WHISK_DEPLOY_DIR_${WHISK_PRODUCT}}"
-                    DEPLOY_DIR_IMAGE = "${DEPLOY_DIR}/images"
-                    """
-                )
-            )
-            f.write(
-                'WHISK_TARGETS_core = "%s"\n'
-                % (" ".join("${WHISK_TARGETS_%s}" % p for p in cur_products))
+            parts.append(
+                SITE_PRODUCT_TEMPLATE.format(p=name, targets=" ".join(targets))
             )
 
-            for p in sorted(conf["products"]):
-                if conf["version"] < 2:
-                    f.write(
-                        'DEPLOY_DIR_{p} = "${{WHISK_DEPLOY_DIR_{p}}}"\n'.format(p=p)
-                    )
+        parts.append("\n")
 
-                f.write(
-                    textwrap.dedent(
-                        """\
-                        WHISK_DEPLOY_DIR_{p} = "${{WHISK_DEPLOY_DIR_BASE}}/{p}"
-                        WHISK_TARGETS_{p} = "{targets}"
-                        """
-                    ).format(
-                        p=p,
-                        targets=" ".join(
-                            sorted(conf["products"][p].get("targets", []))
-                        ),
-                    )
-                )
-
-            f.write("\n")
-
-            multiconfigs = set("product-%s" % p for p in cur_products)
-            for p in cur_products:
-                multiconfigs |= set(conf["products"][p].get("multiconfigs", []))
-
-            f.write(
-                textwrap.dedent(
-                    """\
-                    BBMULTICONFIG = "{multiconfigs}"
-                    BBMASK += "${{BBMASK_${{WHISK_PRODUCT}}}}"
+        multiconfigs = {"product-%s" % p for p in cur_products}.union(
+            *(products[p].get("multiconfigs", ()) for p in cur_products)
+        )
 
-                    BB_HASHBASE_WHITELIST_append = " WHISK_PROJECT_ROOT"
-                    """
-                ).format(multiconfigs=" ".join(sorted(multiconfigs)))
+        parts.append(
+            SITE_MULTICONFIG_TEMPLATE.format(
+                multiconfigs=" ".join(sorted(multiconfigs))
             )
+        )
+        parts.append(conf.get("core", {}).get("conf", ""))
+        parts.append("\n")
 
-            f.write(conf.get("core", {}).get("conf", ""))
-            f.write("\n")
+        outputs[conf_dir / "site.conf"] = parts
 
-        mc_dir = build_dir / "whisk" / "conf" / "multiconfig"
-        mc_dir.mkdir(parents=True, exist_ok=True)
-        for name, p in conf["products"].items():
-            with (mc_dir / ("product-%s.conf" % name)).open("w") as f:
-                f.write(
-                    textwrap.dedent(
-                        """\
-                        # This file was dynamically generated by whisk
-                        WHISK_PRODUCT = "{product}"
-                        WHISK_PRODUCT_DESCRIPTION = "{description}"
-
-                        """
-                    ).format(
-                        product=name,
-                        description=p.get("description", ""),
-                    )
-                )
-
-                f.write(p.get("conf", ""))
-                f.write("\n")
+        for name, _, description, product_conf in product_records:
+            outputs[mc_dir / ("product-%s.conf" % name)] = [
+                get_product_conf(name, description, product_conf)
+            ]
 
-        with (build_dir / "conf" / "bblayers.conf").open("w") as f:
-            f.write(
-                textwrap.dedent(
-                    """\
-                    # This file was dynamically generated by whisk
-                    BBPATH = "${TOPDIR}"
-                    BBFILES ?= ""
+        cur_layers = {l["name"]: l.get("paths", []) for l in version.get("layers", [])}
 
-                    """
-                )
-            )
+        parts = [BBLAYERS_HEADER]
 
-            for name in ["core"] + cur_products:
-                for l, paths in cur_layers.items():
-                    if not l in get_product(name).get("layers", []):
-                        for p in paths:
-                            f.write('BBMASK_%s += "%s"\n' % (name, p))
-                f.write("\n")
+        # Mask out the paths of every layer that a product doesn't use
+        for name in ["core"] + cur_products:
+            product_layers = frozenset(get_product(name).get("layers", []))
+            masked = [
+                p
+                for l, paths in cur_layers.items()
+                if l not in product_layers
+                for p in paths
+            ]
+            parts.append("".join('BBMASK_%s += "%s"\n' % (name, p) for p in masked))
+            parts.append("\n")
 
-            for l in version.get("layers", []):
-                if l["name"] in requested_layers:
-                    for p in l.get("paths", []):
-                        f.write('BBLAYERS += "%s"\n' % p)
+        for l in version.get("layers", []):
+            if l["name"] in requested_layers:
+                for p in l.get("paths", []):
+                    parts.append('BBLAYERS += "%s"\n' % p)
 
-            f.write('BBLAYERS += "%s/meta-whisk"\n\n' % THIS_DIR)
+        parts.append('BBLAYERS += "%s/meta-whisk"\n\n' % THIS_DIR)
+        parts.append("%s\n" % conf.get("core", {}).get("layerconf", ""))
+        parts.append(BBLAYERS_FOOTER)
 
-            f.write("%s\n" % conf.get("core", {}).get("layerconf", ""))
+        outputs[conf_dir / "bblayers.conf"] = parts
 
-            f.write(
-                textwrap.dedent(
-                    """\
-                    # This line gives devtool a place to add its layers
-                    BBLAYERS += ""
-                    """
-                )
-            )
+        # The files are independent of each other, so write them concurrently
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [
+                executor.submit(write_file, path, contents, path in existing)
+                for path, contents in outputs.items()
+            ]
+            for f in futures:
+                f.result()
 
     if write and not sys_args.init:
         return 0
@@ -602,15 +829,16 @@ def configure(sys_args):
 
 
 def validate(args):
+    import fastjsonschema
     import yamllint.linter
     import yamllint.config
 
     ret = 0
     try:
-        with args.conf.open("r") as f, SCHEMA_FILE.open("r") as schema:
-            jsonschema.validate(yaml.load(f, Loader=yaml.Loader), json.load(schema))
-    except jsonschema.ValidationError as e:
-        print(e)
+        with args.conf.open("r") as f:
+            validate_conf(yaml_load(f))
+    except fastjsonschema.JsonSchemaException as e:
+        print(e.message)
         ret = 1
 
     config = yamllint.config.YamlLintConfig(